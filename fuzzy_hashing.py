@@ -2,13 +2,16 @@ import os
 import readline
 import glob
 import sqlite3
-import hashlib
-from pdf2image import convert_from_path, pdfinfo_from_path
-from PIL import Image
+import mmap
+import blake3
+import xxhash
 import ssdeep
 import fitz  # PyMuPDF
+import functools
+import threading
+from queue import Empty
 from collections import defaultdict
-import tempfile
+from multiprocessing import Manager, Pool, cpu_count, get_context
 from tqdm import tqdm
 
 # Enable tab completion
@@ -22,9 +25,21 @@ def complete_path(text, state):
 
 readline.set_completer(complete_path)
 
-# Initialize database
+# Open a database connection with write-friendly PRAGMAs applied
+def open_db(db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.executescript('''
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-65536;
+    ''')
+    return conn
+
+# Initialize database and hand the open connection back to the caller
 def init_db(db_path):
-    conn = sqlite3.connect(db_path)
+    conn = open_db(db_path)
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS page_hashes (
@@ -32,91 +47,298 @@ def init_db(db_path):
             pdf_path TEXT,
             page_number INTEGER,
             page_hash TEXT,
-            original_md5 TEXT
+            original_hash TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_hash (
+            pdf_path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            hash TEXT
         )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_page_hash ON page_hashes(page_hash)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pdf_path ON page_hashes(pdf_path)')
     conn.commit()
-    conn.close()
+    return conn
 
-# Function to hash pages and store in database
-def hash_pdf_pages(pdf_path, db_path):
-    conn = sqlite3.connect(db_path)
+# Per-process cache of ssdeep digests keyed by a cheap 64-bit hash of the
+# rendered pixels; boilerplate pages (blanks, cover sheets, headers)
+# render byte-identically, and a cache hit skips the full ssdeep pass
+_ssdeep_cache = {}
+
+def _ssdeep_hash_cached(raw):
+    key = xxhash.xxh3_64_digest(raw)
+    digest = _ssdeep_cache.get(key)
+    if digest is None:
+        digest = _ssdeep_cache.setdefault(key, ssdeep.hash(raw))
+    return digest
+
+# Per-worker state: the preloaded file-hash cache and the queue draining
+# into the parent's database writer thread, handed to each hash worker
+# process by the pool initializer
+_file_hash_cache = None
+_write_queue = None
+
+def _init_worker(file_hash_cache, write_queue):
+    global _file_hash_cache, _write_queue
+    _file_hash_cache = file_hash_cache
+    _write_queue = write_queue
+
+# Writer thread that drains (table, rows) batches from the queue and
+# flushes them in one transaction per batch, so SQLite only ever sees a
+# single writer no matter how many hash threads are running
+def _db_writer(db_path, write_queue, errors, batch_size=500, flush_interval=2):
+    conn = open_db(db_path)
     cursor = conn.cursor()
+    page_rows = []
+    file_rows = []
+
+    def flush():
+        if not page_rows and not file_rows:
+            return
+        conn.execute('BEGIN')
+        if page_rows:
+            cursor.executemany('''
+                INSERT INTO page_hashes (pdf_path, page_number, page_hash, original_hash)
+                VALUES (?, ?, ?, ?)
+            ''', page_rows)
+            page_rows.clear()
+        if file_rows:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO file_hash (pdf_path, size, mtime, hash)
+                VALUES (?, ?, ?, ?)
+            ''', file_rows)
+            file_rows.clear()
+        conn.commit()
 
+    # A failed flush must not die with a stderr traceback while the rest
+    # of the run keeps queueing rows into the void; record the exception
+    # so the caller can re-raise it after join()
+    try:
+        while True:
+            try:
+                item = write_queue.get(timeout=flush_interval)
+            except Empty:
+                flush()
+                continue
+            if item is None:
+                break
+            table, rows = item
+            (page_rows if table == 'page_hashes' else file_rows).extend(rows)
+            if len(page_rows) + len(file_rows) >= batch_size:
+                flush()
+
+        flush()
+    except Exception as e:
+        errors.append(e)
+    finally:
+        conn.close()
+
+# Function to hash pages and queue the rows for the database writer
+def hash_pdf_pages(pdf_path):
     try:
         print(f"Processing file: {pdf_path}")  # Debug: processing start
 
-        original_md5 = calculate_md5(pdf_path)
-        info = pdfinfo_from_path(pdf_path)
-        total_pages = info["Pages"]
+        original_hash = calculate_file_hash(pdf_path)
+        doc, _ = _open_source_pdf(pdf_path)
+        total_pages = doc.page_count
         pbar = tqdm(total=total_pages, desc=f"Processing pages for {os.path.basename(pdf_path)}", leave=False)
 
-        for page_number in range(1, total_pages + 1):
-            images = convert_from_path(pdf_path, first_page=page_number, last_page=page_number)
-            image = images[0]
-            with tempfile.NamedTemporaryFile(suffix=".png", delete=True) as tmpfile:
-                image.save(tmpfile.name)
-                with open(tmpfile.name, 'rb') as f:
-                    page_hash = ssdeep.hash(f.read())
-                    cursor.execute('''
-                        INSERT INTO page_hashes (pdf_path, page_number, page_hash, original_md5)
-                        VALUES (?, ?, ?, ?)
-                    ''', (pdf_path, page_number, page_hash, original_md5))
+        rows = []
+        for page_index in range(total_pages):
+            # Hash the raw pixel buffer directly; the render is already
+            # deterministic, so the PNG encode/decode round trip through a
+            # temp file added nothing but I/O
+            # 100 DPI grayscale carries the same similarity signal as the
+            # old RGB render at ~1/6 the bytes; keep these settings
+            # constant across a corpus or digests stop being comparable
+            pix = doc.load_page(page_index).get_pixmap(dpi=100, colorspace=fitz.csGRAY)
+            page_hash = _ssdeep_hash_cached(pix.samples)
+            rows.append((pdf_path, page_index + 1, page_hash, original_hash))
             pbar.update(1)
 
         pbar.close()
-        conn.commit()
-        print(f"Processed and committed file: {pdf_path}")  # Debug: processing complete
+
+        _write_queue.put(('page_hashes', rows))
+        print(f"Processed file: {pdf_path}")  # Debug: processing complete
     except Exception as e:
         print(f"Error processing file {pdf_path}: {e}")
-        if 'Unable to get page count' in str(e):
-            print("Please ensure poppler-utils is installed and in your PATH.")
-    finally:
-        conn.close()
 
-def calculate_md5(file_path):
-    hash_md5 = hashlib.md5()
+def calculate_file_hash(file_path):
+    # Skip re-reading the file entirely when it is unchanged since the
+    # last run, keyed by (path, size, mtime) in the preloaded cache
+    st = os.stat(file_path)
+    cached = _file_hash_cache.get(file_path)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime:
+        return cached[2]
+
+    # BLAKE3 over a memory-mapped view: the hash is only an identity tag
+    # for the file, not a security boundary, and blake3 runs ~5-10x faster
+    # than MD5 while the mmap lets the kernel handle readahead
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            file_hash = blake3.blake3(mm).hexdigest()
+
+    _file_hash_cache[file_path] = (st.st_size, st.st_mtime, file_hash)
+    _write_queue.put(('file_hash', [(file_path, st.st_size, st.st_mtime, file_hash)]))
+    return file_hash
+
+# Length of the substrings used for the ssdeep candidate prefilter
+NGRAM_SIZE = 7
+
+def _digest_ngrams(chunk):
+    if len(chunk) < NGRAM_SIZE:
+        return {chunk} if chunk else set()
+    return {chunk[k:k + NGRAM_SIZE] for k in range(len(chunk) - NGRAM_SIZE + 1)}
+
+def _parse_ssdeep(digest):
+    blocksize, chunk1, chunk2 = digest.split(':', 2)
+    return int(blocksize), chunk1, chunk2
+
+# Candidate pairs are scored in chunks this large so the per-task
+# dispatch cost is amortized over many ssdeep.compare calls
+_PAIR_CHUNK_SIZE = 4096
+
+# Digest list and threshold for comparison workers, set by the pool initializer
+_compare_hashes = None
+_compare_threshold = None
+
+def _init_compare_worker(hashes, threshold):
+    global _compare_hashes, _compare_threshold
+    _compare_hashes = hashes
+    _compare_threshold = threshold
+
+def _score_pair_chunk(chunk):
+    matches = []
+    for i, j in chunk:
+        similarity = ssdeep.compare(_compare_hashes[i], _compare_hashes[j])
+        if similarity >= _compare_threshold:
+            matches.append((i, j, similarity))
+    return matches
+
+def _score_candidate_pairs(hashes, pairs, threshold):
+    # The Python frame overhead around each C ssdeep.compare call
+    # dominates at digest length, so large candidate sets are chunked and
+    # fanned out across worker processes; small ones are scored inline
+    # where pool startup would cost more than it saves
+    if len(pairs) <= _PAIR_CHUNK_SIZE:
+        _init_compare_worker(hashes, threshold)
+        return _score_pair_chunk(pairs)
+
+    chunks = [pairs[k:k + _PAIR_CHUNK_SIZE] for k in range(0, len(pairs), _PAIR_CHUNK_SIZE)]
+    matches = []
+    with Pool(cpu_count(), initializer=_init_compare_worker, initargs=(hashes, threshold)) as pool:
+        for chunk_matches in pool.imap_unordered(_score_pair_chunk, chunks):
+            matches.extend(chunk_matches)
+    return matches
 
 def find_similar_pages(db_path, similarity_threshold=70):  # Lowered the threshold to 70
-    conn = sqlite3.connect(db_path)
+    conn = open_db(db_path)
     cursor = conn.cursor()
 
-    cursor.execute('SELECT DISTINCT page_hash FROM page_hashes')
-    hashes = [row[0] for row in cursor.fetchall()]
+    # Preload every row once so the comparison loop never touches SQL
+    cursor.execute('SELECT page_hash, pdf_path, page_number, original_hash FROM page_hashes')
+    pages_by_hash = defaultdict(list)
+    for page_hash, pdf_path, page_number, original_hash in cursor.fetchall():
+        pages_by_hash[page_hash].append((pdf_path, page_number, original_hash))
+    conn.close()
+
+    hashes = list(pages_by_hash.keys())
+
+    # Bucket the n-gram index by blocksize first. ssdeep only ever
+    # compares digests whose blocksizes are equal, doubled, or halved,
+    # and the second chunk is hashed at twice the blocksize of the first,
+    # so filing chunk2 grams in the 2*blocksize bucket lets each digest
+    # resolve its bucket once and probe small, cache-resident gram tables
+    # instead of hashing a (blocksize, gram) tuple per lookup.
+    gram_buckets = defaultdict(lambda: defaultdict(list))
+    parsed = []
+    for i, digest in enumerate(hashes):
+        blocksize, chunk1, chunk2 = _parse_ssdeep(digest)
+        grams1 = _digest_ngrams(chunk1)
+        grams2 = _digest_ngrams(chunk2)
+        parsed.append((blocksize, grams1, grams2))
+        bucket = gram_buckets[blocksize]
+        for gram in grams1:
+            bucket[gram].append(i)
+        bucket = gram_buckets[2 * blocksize]
+        for gram in grams2:
+            bucket[gram].append(i)
 
     similar_pages = defaultdict(list)
 
-    for i in range(len(hashes)):
-        for j in range(i + 1, len(hashes)):
-            similarity = ssdeep.compare(hashes[i], hashes[j])
-            if similarity >= similarity_threshold:
-                print(f"Similarity between page {i+1} and page {j+1}: {similarity}")  # Debug information
-                cursor.execute('SELECT pdf_path, page_number, original_md5 FROM page_hashes WHERE page_hash=?', (hashes[i],))
-                pages_i = cursor.fetchall()
-                cursor.execute('SELECT pdf_path, page_number, original_md5 FROM page_hashes WHERE page_hash=?', (hashes[j],))
-                pages_j = cursor.fetchall()
-                similar_pages[hashes[i]].extend(pages_i)
-                similar_pages[hashes[i]].extend(pages_j)
+    # Exact duplicates first: pages sharing a digest are a 100-similarity
+    # cluster by definition, no ssdeep.compare needed. The fuzzy loop
+    # below then only runs across distinct digests.
+    for page_hash, rows in pages_by_hash.items():
+        if len(rows) > 1:
+            print(f"Exact duplicate cluster for hash {page_hash}: {len(rows)} pages")  # Debug information
+            similar_pages[page_hash].extend(rows)
+
+    candidate_pairs = []
+    for i, (blocksize, grams1, grams2) in enumerate(parsed):
+        candidates = set()
+        bucket = gram_buckets.get(blocksize)
+        if bucket:
+            for gram in grams1:
+                candidates.update(bucket.get(gram, ()))
+        bucket = gram_buckets.get(2 * blocksize)
+        if bucket:
+            for gram in grams2:
+                candidates.update(bucket.get(gram, ()))
+        candidate_pairs.extend((i, j) for j in sorted(candidates) if j > i)
+
+    for i, j, similarity in sorted(_score_candidate_pairs(hashes, candidate_pairs, similarity_threshold)):
+        print(f"Similarity between page {i+1} and page {j+1}: {similarity}")  # Debug information
+        similar_pages[hashes[i]].extend(pages_by_hash[hashes[i]])
+        similar_pages[hashes[i]].extend(pages_by_hash[hashes[j]])
 
-    conn.close()
     return similar_pages
 
+# Memoized opener so each source PDF is parsed once, not once per page.
+# The file is memory-mapped and handed to fitz as a stream, so repeated
+# access hits the OS page cache instead of issuing read() syscalls; the
+# returned mapping is kept alive alongside the document by the cache.
+@functools.lru_cache(maxsize=64)
+def _open_source_pdf(pdf_path):
+    fd = os.open(pdf_path, os.O_RDONLY)
+    try:
+        mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+    # fitz only accepts bytes-like streams, not mmap objects; a
+    # memoryview wraps the mapping without copying it
+    return fitz.open(stream=memoryview(mm), filetype="pdf"), mm
+
 def save_similar_pages(similar_pages, output_dir):
     os.makedirs(output_dir, exist_ok=True)
 
     for hash_, pages in similar_pages.items():
         if len(pages) > 1:
             doc = fitz.open()
-            for pdf_path, page_number, original_md5 in pages:
-                original_doc = fitz.open(pdf_path)
-                page = original_doc.load_page(page_number - 1)
-                doc.insert_pdf(original_doc, from_page=page_number - 1, to_page=page_number - 1)
+            # Group pages by source PDF and insert contiguous runs in one
+            # call each, so insert_pdf amortizes its xref cross-linking
+            pages_by_pdf = defaultdict(set)
+            for pdf_path, page_number, original_hash in pages:
+                pages_by_pdf[pdf_path].add(page_number - 1)
+            for pdf_path, page_indices in pages_by_pdf.items():
+                src, _ = _open_source_pdf(pdf_path)
+                indices = sorted(page_indices)
+                run_start = prev = indices[0]
+                for idx in indices[1:]:
+                    if idx == prev + 1:
+                        prev = idx
+                        continue
+                    doc.insert_pdf(src, from_page=run_start, to_page=prev)
+                    run_start = prev = idx
+                doc.insert_pdf(src, from_page=run_start, to_page=prev)
             output_pdf_path = os.path.join(output_dir, f"{hash_}.pdf")
-            doc.save(output_pdf_path)
+            # Skip the object-graph sweep and zlib pass; these outputs are
+            # review artifacts, not archival copies, and the default save
+            # re-compacts shared resources for every group
+            doc.save(output_pdf_path, garbage=0, deflate=False, clean=False, pretty=False)
             doc.close()
 
 def main():
@@ -129,8 +351,9 @@ def main():
         print(f"Error: The directory '{input_directory}' does not exist.")
         return
 
-    # Initialize the database
-    init_db(db_path)
+    # Initialize the database; the connection is reused for the
+    # file-hash preload below instead of reopening the file
+    conn = init_db(db_path)
 
     # Find all PDF files recursively
     pdf_files = []
@@ -146,14 +369,35 @@ def main():
 
     if total_files == 0:
         print("No PDF files found to process.")
+        conn.close()
         return
 
-    # Process all PDFs sequentially with a progress bar
-    pbar = tqdm(total=total_files, desc="Processing PDFs")
-    for pdf_path in pdf_files:
-        hash_pdf_pages(pdf_path, db_path)
-        pbar.update(1)
-    pbar.close()
+    # Hash PDFs across worker processes: PyMuPDF's bindings hold the GIL
+    # while rendering, so threads would serialize the hot loop. Workers
+    # queue their (table, rows) batches back to the parent's single
+    # writer thread, at the cost of per-process ssdeep/file-hash caches.
+    file_hash_cache = {path: (size, mtime, file_hash) for path, size, mtime, file_hash
+                       in conn.execute('SELECT pdf_path, size, mtime, hash FROM file_hash')}
+    conn.close()
+    manager = Manager()
+    write_queue = manager.Queue()
+    writer_errors = []
+    writer = threading.Thread(target=_db_writer, args=(db_path, write_queue, writer_errors), daemon=True)
+    writer.start()
+
+    # Spawn, not fork: the writer thread is using SQLite while workers
+    # start, and a forked child can inherit a held SQLite mutex
+    ctx = get_context("spawn")
+    with ctx.Pool(cpu_count(), initializer=_init_worker, initargs=(file_hash_cache, write_queue)) as pool:
+        for _ in tqdm(pool.imap_unordered(hash_pdf_pages, pdf_files, chunksize=8),
+                      total=total_files, desc="Processing PDFs"):
+            pass
+
+    # Signal the writer to flush any remaining rows and stop
+    write_queue.put(None)
+    writer.join()
+    if writer_errors:
+        raise writer_errors[0]
 
     # Find similar pages
     similar_pages = find_similar_pages(db_path)
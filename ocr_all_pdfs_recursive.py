@@ -3,8 +3,11 @@ import subprocess
 import readline
 import glob
 import sqlite3
+import threading
+from queue import Empty
+from multiprocessing import Manager, get_context
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Enable tab completion
 readline.parse_and_bind("tab: complete")
@@ -33,9 +36,21 @@ def ocr_pdf(input_pdf, output_pdf, jobs):
     if result.returncode != 0:
         raise subprocess.CalledProcessError(result.returncode, cmd, output=result.stdout, stderr=result.stderr)
 
+# Open a database connection with write-friendly PRAGMAs applied
+def open_db(db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.executescript('''
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-65536;
+    ''')
+    return conn
+
 # Initialize database and create tables if they don't exist
 def init_db(db_path):
-    conn = sqlite3.connect(db_path)
+    conn = open_db(db_path)
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS page_hashes (
@@ -43,7 +58,7 @@ def init_db(db_path):
             pdf_path TEXT,
             page_number INTEGER,
             page_hash TEXT,
-            original_md5 TEXT
+            original_hash TEXT
         )
     ''')
     cursor.execute('''
@@ -58,40 +73,84 @@ def init_db(db_path):
 
 # Function to read the OCR status from the database
 def read_ocr_status(db_path):
-    conn = sqlite3.connect(db_path)
+    conn = open_db(db_path)
     cursor = conn.cursor()
     cursor.execute('SELECT pdf_path, status, attempts FROM ocr_status')
     processed_files = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
     conn.close()
     return processed_files
 
-# Function to update the OCR status in the database
-def update_ocr_status(db_path, pdf_path, status, attempts):
-    conn = sqlite3.connect(db_path)
+# Writer thread that drains status updates from the queue and flushes
+# them in batches, so the workers never open the database for writes
+def status_writer(db_path, status_queue, errors, batch_size=200, flush_interval=2):
+    conn = open_db(db_path)
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO ocr_status (pdf_path, status, attempts)
-        VALUES (?, ?, ?)
-    ''', (pdf_path, status, attempts))
-    conn.commit()
-    conn.close()
-
-# Function to process a single PDF file and update the status
-def process_single_pdf(pdf_path, output_directory, jobs, db_path, retry_limit):
+    batch = []
+
+    def flush():
+        if batch:
+            conn.execute('BEGIN')
+            cursor.executemany('''
+                INSERT OR REPLACE INTO ocr_status (pdf_path, status, attempts)
+                VALUES (?, ?, ?)
+            ''', batch)
+            conn.commit()
+            batch.clear()
+
+    # A failed flush must not die with a stderr traceback while workers
+    # keep queueing updates into the void; record the exception so the
+    # caller can re-raise it after join()
+    try:
+        while True:
+            try:
+                item = status_queue.get(timeout=flush_interval)
+            except Empty:
+                flush()
+                continue
+            if item is None:
+                break
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush()
+
+        flush()
+    except Exception as e:
+        errors.append(e)
+    finally:
+        conn.close()
+
+# One database connection per pool worker, opened by the initializer and
+# reused across tasks
+_worker_conn = None
+
+def _init_worker(db_path):
+    global _worker_conn
+    _worker_conn = open_db(db_path)
+
+# Function to process a single PDF file and report the status
+def process_single_pdf(pdf_path, output_directory, jobs, status_queue, retry_limit, attempts):
     output_pdf_path = os.path.join(output_directory, os.path.basename(pdf_path))
-    processed_files = read_ocr_status(db_path)
-    status, attempts = processed_files.get(pdf_path, ("pending", 0))
+
+    # Point lookup on the PRIMARY KEY for this file's current state: the
+    # status map loaded at startup can be stale by the time a retried
+    # task runs, and a full-table read per task would be O(N) rows
+    row = _worker_conn.execute('SELECT status, attempts FROM ocr_status WHERE pdf_path=?', (pdf_path,)).fetchone()
+    if row:
+        status, db_attempts = row
+        if status == "completed":
+            return
+        attempts = max(attempts, db_attempts)
 
     try:
         ocr_pdf(pdf_path, output_pdf_path, jobs)
-        update_ocr_status(db_path, pdf_path, "completed", attempts)
+        status_queue.put((pdf_path, "completed", attempts))
     except subprocess.CalledProcessError as e:
         attempts += 1
         if attempts >= retry_limit:
             print(f"Error processing file {pdf_path} after {attempts} attempts: {e.stderr}")
-            update_ocr_status(db_path, pdf_path, "failed", attempts)
+            status_queue.put((pdf_path, "failed", attempts))
         else:
-            update_ocr_status(db_path, pdf_path, "retry", attempts)
+            status_queue.put((pdf_path, "retry", attempts))
             raise
 
 # Function to perform OCR on all PDF files in the given directory
@@ -117,26 +176,55 @@ def process_pdfs(input_directory, output_directory, jobs, db_path, retry_limit):
 
     os.makedirs(output_directory, exist_ok=True)
 
-    with ThreadPoolExecutor(max_workers=jobs) as executor:
-        futures = {executor.submit(process_single_pdf, pdf_path, output_directory, jobs, db_path, retry_limit): pdf_path for pdf_path, _ in pdf_files}
+    # Split the cores between the outer pool and ocrmypdf itself; the old
+    # ThreadPoolExecutor(jobs) with --jobs jobs launched jobs*jobs
+    # Tesseract/Ghostscript workers and thrashed the machine
+    inner_jobs = 2
+    outer_jobs = max(1, jobs // inner_jobs)
+
+    # Status was loaded once above; workers report results on a queue and
+    # a single writer thread batches them into the database, instead of
+    # every task re-reading the whole table and committing its own row
+    attempts_map = dict(pdf_files)
+    manager = Manager()
+    status_queue = manager.Queue()
+    writer_errors = []
+    writer = threading.Thread(target=status_writer, args=(db_path, status_queue, writer_errors), daemon=True)
+    writer.start()
+
+    # Spawn, not fork: the writer thread is using SQLite while workers
+    # start, and a forked child can inherit a held SQLite mutex and then
+    # block forever inside _init_worker's connect
+    mp_context = get_context("spawn")
+
+    with ProcessPoolExecutor(max_workers=outer_jobs, mp_context=mp_context, initializer=_init_worker, initargs=(db_path,)) as executor:
+        futures = {executor.submit(process_single_pdf, pdf_path, output_directory, inner_jobs, status_queue, retry_limit, attempts): pdf_path for pdf_path, attempts in pdf_files}
         retry_files = []
         for future in tqdm(as_completed(futures), total=total_files, desc="Processing PDFs", unit="file"):
             try:
                 future.result()  # This will raise any exceptions caught during processing
             except Exception as e:
-                retry_files.append(futures[future])
+                pdf_path = futures[future]
+                attempts_map[pdf_path] += 1
+                retry_files.append(pdf_path)
 
     # Retry failed files
     if retry_files:
         print(f"\nRetrying {len(retry_files)} failed files...\n")
-        with ThreadPoolExecutor(max_workers=jobs) as executor:
-            futures = {executor.submit(process_single_pdf, pdf_path, output_directory, jobs, db_path, retry_limit): pdf_path for pdf_path in retry_files}
+        with ProcessPoolExecutor(max_workers=outer_jobs, mp_context=mp_context, initializer=_init_worker, initargs=(db_path,)) as executor:
+            futures = {executor.submit(process_single_pdf, pdf_path, output_directory, inner_jobs, status_queue, retry_limit, attempts_map[pdf_path]): pdf_path for pdf_path in retry_files}
             for future in tqdm(as_completed(futures), total=len(retry_files), desc="Retrying PDFs", unit="file"):
                 try:
                     future.result()
                 except Exception as e:
                     print(f"File failed after multiple attempts: {futures[future]}")
 
+    # Signal the writer to flush any remaining updates and stop
+    status_queue.put(None)
+    writer.join()
+    if writer_errors:
+        raise writer_errors[0]
+
 def main():
     input_directory = input("Enter the path to the directory containing PDFs: ").strip()
     output_directory = input("Enter the path to the output directory for processed PDFs: ").strip()